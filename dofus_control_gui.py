@@ -3,6 +3,9 @@ import sys
 import json
 import subprocess
 import os
+import select
+import shlex
+import threading
 from pathlib import Path
 from typing import Dict, List, Tuple
 import time
@@ -28,8 +31,25 @@ DISPLAY = os.getenv('DISPLAY', ':0')
 PROFILES_DIR = Path(os.getenv('PROFILES_DIR', str(Path.home() / ".config/dofus_linux_toolbox")))
 os.environ['DISPLAY'] = DISPLAY
 
+# pactl traduit sa sortie (bureaux en français) : on la force en anglais pour la parser
+C_LOCALE_ENV = {**os.environ, 'LC_ALL': 'C'}
+
+def env_number(name: str, default, cast=int):
+    try:
+        return cast(os.getenv(name) or default)
+    except ValueError:
+        print(f"Attention : valeur invalide pour {name}, utilisation de {default}")
+        return default
+
+# Lancement des clients
+LAUNCH_CMD = os.getenv('DOFUS_LAUNCH_CMD', '')
+LAUNCH_MAX_PARALLEL = env_number('LAUNCH_MAX_PARALLEL', 2)
+LAUNCH_STAGGER = env_number('LAUNCH_STAGGER', 1.0, float)
+LAUNCH_TIMEOUT = env_number('LAUNCH_TIMEOUT', 120.0, float)
+
 SCRIPTS_DIR = None
 PROFILES_FILE = None
+SESSION_FILE = None
 ALWAYS_ON_TOP = False
 
 # ==================== Fonctions utilitaires ==================== #
@@ -54,9 +74,9 @@ def save_initiative(profile_name: str) -> None:
     data["active"] = profile_name
     save_data(data)
 
-def run_cmd(cmd: List[str], timeout=5) -> Tuple[str, int]:
+def run_cmd(cmd: List[str], timeout=5, env=None) -> Tuple[str, int]:
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=env)
         return result.stdout.strip(), result.returncode
     except:
         return "", 1
@@ -75,6 +95,109 @@ def get_dofus_windows() -> List[Tuple[str, str]]:
             windows.append((win_id, win_name))
     return windows
 
+def get_window_pid(win_id: str) -> str:
+    pid_out, _ = run_cmd(['xprop', '-id', win_id, '_NET_WM_PID'])
+    if pid_out and '=' in pid_out:
+        return pid_out.split('=')[1].strip()
+    return ""
+
+def mute_windows(win_ids: List[str]) -> None:
+    cmds = []
+    for win_id in win_ids:
+        pid = get_window_pid(win_id)
+        if pid:
+            print(f"DEBUG: Muting PID {pid}")
+            cmds.append(f"pactl list sink-inputs 2>/dev/null | grep -B5 'process.id = \"{pid}\"' | grep 'Sink Input' | awk '{{print $3}}' | xargs -r -I {{}} pactl set-sink-input-mute {{}} 1 2>/dev/null")
+    if cmds:
+        subprocess.Popen(['bash', '-c', ' && '.join(cmds)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         env=C_LOCALE_ENV)
+
+def get_frame_extents(win_id: str) -> Tuple[int, int, int, int]:
+    out, _ = run_cmd(['xprop', '-id', win_id, '_NET_FRAME_EXTENTS'])
+    try:
+        left, right, top, bottom = (int(v) for v in out.split('=')[1].split(','))
+        return left, right, top, bottom
+    except (IndexError, ValueError):
+        return 0, 0, 0, 0
+
+def get_sink_inputs() -> List[Tuple[str, str, bool]]:
+    out, code = run_cmd(['pactl', 'list', 'sink-inputs'], env=C_LOCALE_ENV)
+    if code != 0:
+        return []
+    sink_inputs = []
+    index, is_muted = "", False
+    for line in out.splitlines():
+        line = line.strip()
+        if line.startswith("Sink Input #"):
+            index, is_muted = line[len("Sink Input #"):], False
+        elif line.startswith("Mute:"):
+            is_muted = line.endswith("yes")
+        elif line.startswith("application.process.id") and '=' in line:
+            sink_inputs.append((index, line.split('=')[1].strip().strip('"'), is_muted))
+    return sink_inputs
+
+def get_muted_pids() -> set:
+    return {pid for _, pid, is_muted in get_sink_inputs() if is_muted}
+
+def spy_client_list() -> subprocess.Popen:
+    # xprop -spy notifie chaque changement de _NET_CLIENT_LIST (fenêtre mappée/fermée)
+    return subprocess.Popen(['xprop', '-root', '-spy', '_NET_CLIENT_LIST'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+def wait_event(spy: subprocess.Popen, timeout: float) -> None:
+    if spy.poll() is None:
+        ready, _, _ = select.select([spy.stdout], [], [], timeout)
+        if ready and not os.read(spy.stdout.fileno(), 4096):
+            spy.wait()
+    else:
+        time.sleep(timeout)
+
+def set_mute_when_ready(win_ids: List[str], mute: bool = True) -> None:
+    # Un client qui vient de s'ouvrir n'a pas encore de flux audio :
+    # on attend l'apparition de son sink-input via pactl subscribe
+    pids = {get_window_pid(win_id) for win_id in win_ids} - {""}
+    if not pids:
+        return
+    events = subprocess.Popen(['pactl', 'subscribe'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              env=C_LOCALE_ENV)
+    deadline = time.monotonic() + LAUNCH_TIMEOUT
+    try:
+        while pids:
+            for index, pid, _ in get_sink_inputs():
+                if pid in pids:
+                    print(f"DEBUG: {'Muting' if mute else 'Unmuting'} PID {pid}")
+                    run_cmd(['pactl', 'set-sink-input-mute', index, str(int(mute))])
+                    pids.discard(pid)
+            if not pids or time.monotonic() >= deadline:
+                break
+            wait_event(events, 1.0)
+    finally:
+        events.terminate()
+
+    for pid in pids:
+        print(f"Erreur : aucun flux audio pour le PID {pid}")
+
+def mute_windows_when_ready(win_ids: List[str], mute: bool = True) -> None:
+    threading.Thread(target=set_mute_when_ready, args=(win_ids, mute), daemon=True).start()
+
+def belongs_to(pid: int, root: int) -> bool:
+    # Les lanceurs (AppImage, script, wine, flatpak) forkent : le PID de la fenêtre
+    # n'est pas celui du processus lancé, on remonte la session puis les parents
+    try:
+        if os.getsid(pid) == root:
+            return True
+    except OSError:
+        pass
+    while pid > 1:
+        if pid == root:
+            return True
+        try:
+            with open(f"/proc/{pid}/stat", 'r') as f:
+                pid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            return False
+    return False
+
 def update_cycle_scripts(profile_name: str) -> None:
     profiles, _ = load_profiles()
     profile_data = profiles.get(profile_name, {})
@@ -151,15 +274,7 @@ def rename_windows(profile_name: str) -> None:
 
     if len(windows) > 1:
         print(f"DEBUG: Muting {len(windows) - 1} fenêtres")
-        cmds = []
-        for win_id, _ in windows[1:]:
-            pid_out, _ = run_cmd(['xprop', '-id', win_id, '_NET_WM_PID'])
-            if pid_out and '=' in pid_out:
-                pid = pid_out.split('=')[1].strip()
-                print(f"DEBUG: Muting PID {pid}")
-                cmds.append(f"pactl list sink-inputs 2>/dev/null | grep -B5 'process.id = \"{pid}\"' | grep 'Sink Input' | awk '{{print $3}}' | xargs -r -I {{}} pactl set-sink-input-mute {{}} 1 2>/dev/null")
-        if cmds:
-            subprocess.Popen(['bash', '-c', ' && '.join(cmds)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        mute_windows([win_id for win_id, _ in windows[1:]])
 
 def reorganize_windows(profile_name: str) -> None:
     profiles, _ = load_profiles()
@@ -227,6 +342,278 @@ def invite_group(profile_name: str) -> None:
         run_cmd(['xdotool', 'key', 'Return'])
         time.sleep(0.1)
 
+def launch_delay() -> float:
+    # Espacement adapté à la charge : plus la machine est chargée, plus on attend
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        load = 0.0
+    return LAUNCH_STAGGER * min(max(1.0, 2 * load), 10.0)
+
+def bind_window(win_id: str, class_name: str, mute: bool) -> None:
+    new_name = f"Dofus-{class_name}"
+    print(f"DEBUG: Liaison {win_id} à '{new_name}'")
+    run_cmd(['wmctrl', '-ir', win_id, '-b', 'remove,maximized_vert,maximized_horz'])
+    run_cmd(['wmctrl', '-ir', win_id, '-N', new_name])
+    if mute:
+        mute_windows_when_ready([win_id])
+
+def launch_clients(profile_name: str) -> None:
+    profiles, _ = load_profiles()
+    profile_data = profiles.get(profile_name, {})
+    
+    if isinstance(profile_data, dict):
+        initiative = profile_data.get("windows", [])
+        launch_cmd = profile_data.get("launch_command", LAUNCH_CMD)
+        try:
+            max_parallel = max(1, int(profile_data.get("launch_parallel", LAUNCH_MAX_PARALLEL)))
+        except (TypeError, ValueError):
+            print(f"Attention : launch_parallel invalide, utilisation de {LAUNCH_MAX_PARALLEL}")
+            max_parallel = max(1, LAUNCH_MAX_PARALLEL)
+    else:
+        initiative = profile_data
+        launch_cmd = LAUNCH_CMD
+        max_parallel = max(1, LAUNCH_MAX_PARALLEL)
+    
+    if not initiative:
+        print("Erreur : pas de fenêtres dans le profil")
+        return
+    
+    if not launch_cmd:
+        print("Erreur : aucune commande de lancement configurée")
+        return
+
+    try:
+        launch_args = shlex.split(launch_cmd)
+    except ValueError as e:
+        print(f"Erreur : commande de lancement invalide : {e}")
+        return
+
+    # Les fenêtres déjà ouvertes ne sont pas liées aux nouveaux clients
+    known = {win_id for win_id, _ in get_dofus_windows()}
+    pending = list(range(len(initiative)))
+    launched = {}
+    starting = {}
+    bound = set()
+    orphans = []
+    next_launch = 0.0
+    spy = spy_client_list()
+    try:
+        while pending or starting:
+            now = time.monotonic()
+            while pending and len(starting) < max_parallel and now >= next_launch:
+                slot = pending.pop(0)
+                print(f"DEBUG: Lancement du client {initiative[slot]}")
+                try:
+                    proc = subprocess.Popen(launch_args, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL, start_new_session=True)
+                except OSError as e:
+                    print(f"Erreur : lancement impossible : {e}")
+                    pending.clear()
+                    break
+                launched[slot] = proc
+                starting[slot] = now
+                next_launch = now + launch_delay()
+
+            windows = [win_id for win_id, _ in get_dofus_windows()]
+            new = [win_id for win_id in windows if win_id not in known]
+            known.update(new)
+            orphans = [win_id for win_id in orphans if win_id in windows]
+            for win_id in orphans + new:
+                pid = get_window_pid(win_id)
+                # Lien par arbre de processus
+                slot = next((s for s, p in launched.items() if pid and belongs_to(int(pid), p.pid)), None)
+                # Lanceurs détachés (sortis en code 0) : plus d'arbre de processus à suivre
+                detached = [s for s in starting if launched[s].poll() == 0]
+                if slot in bound:
+                    # Place déjà prise : la fenêtre passe sur une place libre encore en démarrage
+                    free = detached or list(starting)
+                    slot = min(free) if free else None
+                elif slot is None:
+                    # L'ordre de lancement en dernier recours, seulement pour les lanceurs détachés
+                    slot = min(detached) if detached else None
+                if slot is None:
+                    if win_id not in orphans:
+                        print(f"DEBUG: Fenêtre {win_id} sans client associé, en attente")
+                        orphans.append(win_id)
+                    continue
+                if win_id in orphans:
+                    orphans.remove(win_id)
+                starting.pop(slot, None)
+                bound.add(slot)
+                bind_window(win_id, initiative[slot], mute=slot > 0)
+
+            for slot, started in list(starting.items()):
+                # Code 0 : lanceur détaché, le client peut encore ouvrir sa fenêtre
+                code = launched[slot].poll()
+                if code:
+                    print(f"Erreur : le client {initiative[slot]} s'est arrêté (code {code})")
+                    del starting[slot]
+                elif now - started > LAUNCH_TIMEOUT:
+                    print(f"Erreur : la fenêtre {initiative[slot]} n'est pas apparue")
+                    del starting[slot]
+
+            if not (pending or starting):
+                break
+
+            timeout = 1.0
+            if pending and len(starting) < max_parallel:
+                timeout = min(timeout, max(0.0, next_launch - time.monotonic()))
+
+            wait_event(spy, timeout)
+    finally:
+        spy.terminate()
+
+    for win_id in orphans:
+        print(f"Erreur : fenêtre {win_id} ignorée, aucun client associé")
+
+def load_session() -> Dict:
+    try:
+        with open(SESSION_FILE, 'r') as f:
+            return json.load(f)
+    except:
+        return {}
+
+def snapshot_session(profile_name: str) -> None:
+    profiles, _ = load_profiles()
+    profile_data = profiles.get(profile_name, {})
+    
+    if isinstance(profile_data, dict):
+        initiative = profile_data.get("windows", [])
+        characters = profile_data.get("characters", [])
+    else:
+        initiative = profile_data
+        characters = []
+    
+    out, code = run_cmd(['wmctrl', '-l', '-G', '-p'])
+    if code != 0:
+        return
+    muted = get_muted_pids()
+    
+    entries = []
+    for line in out.splitlines():
+        parts = line.split(None, 8)
+        if len(parts) < 9:
+            continue
+        win_id, workspace, pid, x, y, w, h, _, win_name = parts
+        class_name = win_name[len("Dofus-"):]
+        # Seules les fenêtres liées à une classe du profil ont une place à restaurer
+        if not win_name.startswith("Dofus-") or class_name not in initiative:
+            continue
+        idx = initiative.index(class_name)
+        # wmctrl -G donne la zone client, wmctrl -e place le cadre : on retire la décoration
+        left, _, top, _ = get_frame_extents(win_id)
+        entries.append((idx, {
+            "name": win_name,
+            "character": characters[idx] if idx < len(characters) else "",
+            "workspace": int(workspace),
+            "geometry": [int(x) - left, int(y) - top, int(w), int(h)],
+            "muted": pid in muted,
+        }))
+    
+    if not entries:
+        print("Erreur : aucune fenêtre Dofus trouvée")
+        return
+    
+    # Ordre de l'initiative : ordre des fenêtres et des places libres à la restauration
+    entries.sort(key=lambda entry: entry[0])
+    slots = [slot for _, slot in entries]
+    print(f"DEBUG: Snapshot de {len(slots)} fenêtres dans {SESSION_FILE}")
+    with open(SESSION_FILE, 'w') as f:
+        json.dump({"profile": profile_name, "windows": slots}, f, separators=(',', ':'))
+
+def apply_session(matched: List[Tuple[str, Dict]]) -> None:
+    # Un seul appel bash pour toutes les fenêtres au lieu d'un wmctrl par action
+    cmds = []
+    for win_id, slot in matched:
+        print(f"DEBUG: Restauration {win_id} en '{slot['name']}'")
+        x, y, w, h = slot["geometry"]
+        cmds += [
+            ['wmctrl', '-ir', win_id, '-b', 'remove,maximized_vert,maximized_horz'],
+            ['wmctrl', '-ir', win_id, '-N', slot["name"]],
+            ['wmctrl', '-ir', win_id, '-e', f"0,{x},{y},{w},{h}"],
+        ]
+    run_cmd(['bash', '-c', '; '.join(shlex.join(cmd) for cmd in cmds)], timeout=5 + len(cmds))
+    mute_windows_when_ready([win_id for win_id, slot in matched if slot["muted"]], mute=True)
+    mute_windows_when_ready([win_id for win_id, slot in matched if not slot["muted"]], mute=False)
+
+def restore_order(restored: List[Tuple[str, Dict]]) -> None:
+    # Comme reorganize_windows : toutes les fenêtres sortent de leur espace de travail
+    # puis y reviennent dans l'ordre de l'initiative, en un seul appel bash
+    cmds = []
+    for win_id, slot in restored:
+        other_ws = '1' if slot["workspace"] == 0 else '0'
+        cmds.append(shlex.join(['wmctrl', '-ir', win_id, '-t', other_ws]))
+    cmds.append("sleep 0.3")
+    for win_id, slot in restored:
+        cmds.append(shlex.join(['wmctrl', '-ir', win_id, '-t', str(slot["workspace"])]))
+        cmds.append("sleep 0.1")
+    run_cmd(['bash', '-c', '; '.join(cmds)], timeout=5 + len(cmds))
+
+def check_session_characters(session: Dict) -> None:
+    profiles, _ = load_profiles()
+    profile_data = profiles.get(session.get("profile", ""), {})
+    
+    if isinstance(profile_data, dict):
+        initiative = profile_data.get("windows", [])
+        characters = profile_data.get("characters", [])
+    else:
+        initiative = profile_data
+        characters = []
+    
+    bindings = dict(zip(initiative, characters))
+    for slot in session.get("windows", []):
+        class_name = slot["name"][len("Dofus-"):]
+        if slot.get("character") and bindings.get(class_name) != slot["character"]:
+            print(f"Attention : {slot['name']} était lié à '{slot['character']}', "
+                  f"le profil indique '{bindings.get(class_name, '')}'")
+
+def restore_session() -> None:
+    session = load_session()
+    slots = [slot for slot in session.get("windows", []) if slot["name"].startswith("Dofus-")]
+    pending = list(slots)
+    if not pending:
+        print("Erreur : aucun snapshot de session")
+        return
+
+    check_session_characters(session)
+
+    known = set()
+    restored = []
+    deadline = time.monotonic() + LAUNCH_TIMEOUT
+    spy = spy_client_list()
+    try:
+        while pending:
+            windows = [w for w in get_dofus_windows() if w[0] not in known]
+            matched = []
+            # Fenêtres encore nommées : retour direct à leur place
+            for win_id, win_name in windows:
+                slot = next((s for s in pending if s["name"] == win_name), None)
+                if slot:
+                    pending.remove(slot)
+                    matched.append((win_id, slot))
+            # Nouvelles fenêtres "Dofus" : places libres dans l'ordre de l'initiative
+            for win_id, win_name in windows:
+                if win_name == "Dofus" and pending:
+                    matched.append((win_id, pending.pop(0)))
+            known.update(win_id for win_id, _ in windows)
+
+            if matched:
+                apply_session(matched)
+                restored += matched
+
+            if not pending or time.monotonic() >= deadline:
+                break
+            wait_event(spy, 1.0)
+    finally:
+        spy.terminate()
+
+    if restored:
+        restore_order(sorted(restored, key=lambda match: slots.index(match[1])))
+
+    for slot in pending:
+        print(f"Erreur : la fenêtre {slot['name']} n'est pas réapparue")
+
 # ==================== Dialogue de compte à rebours ==================== #
 
 class CountdownDialog(QDialog):
@@ -429,6 +816,7 @@ class DofusControl(QMainWindow):
         self.profiles = {}
         self.active_profile = ""
         self.drag_start = None
+        self.worker_thread = None
         
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
         self.setStyleSheet("QMainWindow { background-color: #0d0805; }")
@@ -510,6 +898,16 @@ class DofusControl(QMainWindow):
         self.load_btn.setToolTip("Charger un json pour les profiles")
         grid.addWidget(self.load_btn, 0, 1, Qt.AlignHCenter)
         
+        self.snapshot_btn = ActionButton("📸", 80)
+        self.snapshot_btn.clicked.connect(self.action_snapshot)
+        self.snapshot_btn.setToolTip("Sauvegarder la session")
+        grid.addWidget(self.snapshot_btn, 0, 0, Qt.AlignHCenter)
+        
+        self.restore_btn = ActionButton("♻", 80)
+        self.restore_btn.clicked.connect(self.action_restore)
+        self.restore_btn.setToolTip("Restaurer la session")
+        grid.addWidget(self.restore_btn, 0, 2, Qt.AlignHCenter)
+        
         # Middle row
         self.rename_btn = ActionButton("📝", 80)
         self.rename_btn.clicked.connect(self.action_rename)
@@ -532,6 +930,11 @@ class DofusControl(QMainWindow):
         self.invite_btn.setToolTip("Inviter groupe")
         grid.addWidget(self.invite_btn, 2, 1, Qt.AlignHCenter)
         
+        self.launch_btn = ActionButton("🚀", 80)
+        self.launch_btn.clicked.connect(self.action_launch)
+        self.launch_btn.setToolTip("Lancer les clients")
+        grid.addWidget(self.launch_btn, 2, 0, Qt.AlignHCenter)
+        
         main_layout.addLayout(grid)
         main_layout.addStretch()
         
@@ -573,9 +976,10 @@ class DofusControl(QMainWindow):
         if not file_path:
             return
         
-        global PROFILES_FILE, SCRIPTS_DIR
+        global PROFILES_FILE, SCRIPTS_DIR, SESSION_FILE
         PROFILES_FILE = Path(file_path)
         SCRIPTS_DIR = PROFILES_FILE.parent / "scripts"
+        SESSION_FILE = PROFILES_FILE.parent / "session.json"
         
         config_file = APP_DIR / "last_profile.txt"
         with open(config_file, 'w') as f:
@@ -602,9 +1006,10 @@ class DofusControl(QMainWindow):
             except:
                 pass
         
-        global PROFILES_FILE, SCRIPTS_DIR
+        global PROFILES_FILE, SCRIPTS_DIR, SESSION_FILE
         PROFILES_FILE = default_path
         SCRIPTS_DIR = default_path.parent / "scripts"
+        SESSION_FILE = default_path.parent / "session.json"
         
         if default_path.exists():
             try:
@@ -653,6 +1058,9 @@ class DofusControl(QMainWindow):
         if not PROFILES_FILE or not PROFILES_FILE.exists():
             return
         
+        if self.is_busy():
+            return
+        
         windows = get_dofus_windows()
         if not windows:
             return
@@ -665,6 +1073,9 @@ class DofusControl(QMainWindow):
         if not PROFILES_FILE or not PROFILES_FILE.exists():
             return
         
+        if self.is_busy():
+            return
+        
         windows = get_dofus_windows()
         if not windows:
             return
@@ -673,6 +1084,49 @@ class DofusControl(QMainWindow):
         if profile_name:
             reorganize_windows(profile_name)
     
+    def action_launch(self):
+        if not PROFILES_FILE or not PROFILES_FILE.exists():
+            return
+        
+        if self.is_busy():
+            return
+        
+        profile_name = self.profile_combo.currentText()
+        if profile_name:
+            self.start_worker(launch_clients, profile_name)
+    
+    def is_busy(self):
+        # Un seul traitement des fenêtres à la fois, sinon ils se disputent les mêmes fenêtres
+        return self.worker_thread is not None and self.worker_thread.is_alive()
+    
+    def start_worker(self, target, *args):
+        self.worker_thread = threading.Thread(target=target, args=args, daemon=True)
+        self.worker_thread.start()
+    
+    def action_snapshot(self):
+        if not PROFILES_FILE or not PROFILES_FILE.exists():
+            return
+        
+        if self.is_busy():
+            return
+        
+        profile_name = self.profile_combo.currentText()
+        if profile_name:
+            snapshot_session(profile_name)
+    
+    def action_restore(self):
+        if not SESSION_FILE or not SESSION_FILE.exists():
+            return
+        
+        if self.is_busy():
+            return
+        
+        profile_name = load_session().get("profile", "")
+        if profile_name in self.profiles:
+            self.profile_combo.setCurrentText(profile_name)
+        
+        self.start_worker(restore_session)
+    
     def action_invite_group(self):
         if not PROFILES_FILE or not PROFILES_FILE.exists():
             return